@@ -15,6 +15,16 @@ parser.add_argument('--ssh_addr', type=str,
 					help='This orchestrator is meant to remotely start your server : please provide tu url/port of the ssh server',
                     required=True
                     )
+parser.add_argument('--deploy_from', type=str, 
+					help='Local copy of Wav2Lip_with_cache : the changed files are uploaded to the remote server before daemon.py starts',
+                    required=False,
+                    default=None
+                    )
+parser.add_argument('--ssh_forward', 
+					help='Reach daemon.py through a port forward on the SSH connection of the server worker, instead of the --server_addr / SERVER_ADDR tunnel',
+                    required=False,
+                    action='store_true'
+                    )
 parser.add_argument('--debug', 
 					help='This will replace the relative paths of the modules with absolute urls from the source code',
                     required=False,
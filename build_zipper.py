@@ -1,20 +1,128 @@
-import os
+import os, json, struct, zlib
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from workers.file_hashes import hash_chunk_size, fingerprint
 
 # Paths
 dist_dir = "dist/dist_master"
 blacklisted_filenames = ["lightning_rsa", "lightning_rsa.pub", ".env", "Avatar_Small_Local.mp4"]
 output_zip = "Chatty_Avatar.zip"
+manifest_path = "Chatty_Avatar.manifest.json"
 
-# Create ZIP file while excluding the SSH key
-with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as zipf:
+# Media that is already compressed : deflating it again costs time and gains nothing
+stored_extensions = [".mp4", ".mp3", ".wav", ".webm", ".png", ".jpg", ".jpeg", ".ico", ".zip", ".7z", ".gz"]
+
+# Compressed entries are held in memory until their turn to be written : bound how many are in flight
+pool_size = os.cpu_count() or 1
+max_in_flight = 2 * pool_size
+
+def compress_file(file_path):
+    # Runs in the process pool : returns a raw deflate stream, as it is laid out in a zip entry
+    crc = 0
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    chunks = []
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(hash_chunk_size), b""):
+            crc = zlib.crc32(chunk, crc)
+            chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    return crc, b"".join(chunks)
+
+def load_manifest():
+    if not os.path.exists(manifest_path) or not os.path.exists(output_zip):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+def list_files():
+    entries = []
     for root, dirs, files in os.walk(dist_dir):
         for file in files:
             if file in blacklisted_filenames:
                 print(f"Excluding {file} from zip.")
                 continue  # Skip the SSH key
             file_path = os.path.join(root, file)
-            arcname = os.path.relpath(file_path, dist_dir)  # Preserve folder structure
-            zipf.write(file_path, arcname)
+            arcname = os.path.relpath(file_path, dist_dir).replace(os.sep, "/")  # Preserve folder structure
+            entries.append((file_path, arcname))
+    return entries
+
+def read_raw_entry(zin, info):
+    # Skip the local file header and return the compressed bytes untouched
+    zin.fp.seek(info.header_offset)
+    header = zin.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    zin.fp.seek(name_length + extra_length, os.SEEK_CUR)
+    return zin.fp.read(info.compress_size)
+
+def write_raw_entry(zipf, zinfo, data):
+    # zipfile has no public API to add an entry that is already compressed,
+    # so the local header is written by hand and the central directory left to zipf.close()
+    zinfo.compress_size = len(data)
+    zinfo.header_offset = zipf.fp.tell()
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    zipf.fp.write(data)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+    zipf._didModify = True
+
+def build():
+    previous_manifest = load_manifest()
+    entries = list_files()
+
+    manifest = {}
+    for file_path, arcname in entries:
+        manifest[arcname] = fingerprint(file_path, previous_manifest.get(arcname))
+
+    previous_zip = zipfile.ZipFile(output_zip, "r") if previous_manifest else None
+    previous_names = set(previous_zip.namelist()) if previous_zip else set()
+    reused = {
+        arcname for arcname in manifest
+        if arcname in previous_names and previous_manifest.get(arcname, {}).get("sha256") == manifest[arcname]["sha256"]
+    }
+    to_compress = [
+        (file_path, arcname) for file_path, arcname in entries
+        if arcname not in reused and os.path.splitext(arcname)[1].lower() not in stored_extensions
+    ]
+    print(f"{len(reused)} unchanged, {len(entries) - len(reused)} to pack ({len(to_compress)} to compress).")
+
+    tmp_zip = output_zip + ".tmp"
+    try:
+        with ProcessPoolExecutor(max_workers=pool_size) as pool, zipfile.ZipFile(tmp_zip, "w", zipfile.ZIP_DEFLATED) as zipf:
+            # to_compress is in walk order, like the writing loop : the entry written next is always the oldest job in flight
+            pending = iter(to_compress)
+            futures = {}
+            def submit_next():
+                for file_path, arcname in pending:
+                    futures[arcname] = pool.submit(compress_file, file_path)
+                    return
+            for _ in range(max_in_flight):
+                submit_next()
+
+            for file_path, arcname in entries:
+                zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+                if arcname in reused:
+                    previous_info = previous_zip.getinfo(arcname)
+                    zinfo.compress_type = previous_info.compress_type
+                    zinfo.CRC = previous_info.CRC
+                    write_raw_entry(zipf, zinfo, read_raw_entry(previous_zip, previous_info))
+                elif arcname in futures:
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                    zinfo.CRC, data = futures.pop(arcname).result()
+                    submit_next()
+                    write_raw_entry(zipf, zinfo, data)
+                else:
+                    zipf.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
+    finally:
+        if previous_zip:
+            previous_zip.close()
+
+    os.replace(tmp_zip, output_zip)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    print(f"Created {output_zip} without {blacklisted_filenames}.")
 
-print(f"Created {output_zip} without {blacklisted_filenames}.")
+if __name__ == "__main__":
+    build()
@@ -7,6 +7,37 @@ from args_parser import args
 class MainConfig():
     run_server_command = ""
     remote_env_init_command = "source /settings/.lightningrc && "
+    remote_server_dir = "Wav2Lip_with_cache"
+    telemetry_interval = 2  # seconds between two samples of the remote host
+    telemetry_history = 900  # samples kept by the orchestrator
+    daemon_port = 3000  # port daemon.py listens on, on the SSH server
+    forward_local_port = 3100  # local end of the --ssh_forward tunnel, given to the runner as SERVER_ADDR
+    trace_readiness_markers = [r"Running on http", r"\bready\b"]  # output lines marked as readiness in the session trace
+    trace_sessions_kept = 10
+    # Applied to the subprocess of each worker at launch (None leaves the OS default) :
+    # cpu_affinity : list of cores, nice : -20 (highest) to 19 (mapped to a priority class on Windows),
+    # ionice : {"class" : "realtime" | "best_effort" | "idle", "level" : 0 (highest) to 7, Linux only},
+    # memory_limit_mb and cpu_time_limit_s : rlimits on Linux (address space, CPU time),
+    # a job object on Windows (committed memory, user-mode CPU time)
+    launch_profiles = {
+        "playback": {"cpu_affinity": None, "nice": -5, "ionice": {"class": "best_effort", "level": 0}},
+        "client": {"cpu_affinity": None, "nice": None, "memory_limit_mb": None, "cpu_time_limit_s": None},
+    }
+    # Output watchdog of the running workers (None disables a check) :
+    # stalled after stall_after_s without any output line, counted from the first line the worker printed.
+    # daemon.py and Avatar_runner only print when a request comes in, so an idle session with nobody speaking
+    # counts as a stall : only set stall_after_s for a worker which prints regularly, or well above the longest idle time.
+    # degraded when the rate over rate_window_s falls under degraded_ratio of the learned baseline or under min_lines_per_min
+    # (a silent window isn't degraded). As for the stalls, the rate of the server and the client follows the user traffic :
+    # a window draining after a burst of requests looks degraded, so only set degraded_ratio for a worker with a steady output.
+    # restart_on lists the states ("stalled", "degraded") which make the watchdog restart the worker,
+    # at most max_restarts times per start from the user, waiting restart_backoff_s, then twice as long...
+    watchdog_interval = 2
+    watchdog_thresholds = {
+        "server": {"stall_after_s": None, "rate_window_s": 60, "degraded_ratio": None, "min_lines_per_min": None, "restart_on": [], "max_restarts": 3, "restart_backoff_s": 30},
+        "playback": {"stall_after_s": None, "rate_window_s": 60, "degraded_ratio": None, "min_lines_per_min": None, "restart_on": [], "max_restarts": 3, "restart_backoff_s": 30},
+        "client": {"stall_after_s": None, "rate_window_s": 60, "degraded_ratio": None, "min_lines_per_min": None, "restart_on": [], "max_restarts": 3, "restart_backoff_s": 30},
+    }
     def __init__(self):
         if args.ssh_addr.split("@")[1] == "localhost":
             self.run_server_command = f'cd "{os.getenv("SERVER_PATH")}" && python -u daemon.py'
@@ -46,7 +46,8 @@ def worker_routes(manager):
         data = request.json
         name = data.get("name")
         try:
-            result = manager.start_worker(name)
+            with manager.tracer.span("POST /start_worker", "route", worker=name):
+                result = manager.start_worker(name)
             return jsonify({"type" : "success", "message": f"{get_time()} SUCCESS : Request for {name} startup transmitted successfully.", "message_stack" : result['message_stack']})
         except Exception as e:
             return jsonify({"type" : "error", "message" : f"{get_time()} {str(e)}"}), 200
@@ -57,7 +58,8 @@ def worker_routes(manager):
         data = request.json
         name = data.get("name")
         try:
-            status_obj = manager.stop_worker(name)
+            with manager.tracer.span("POST /stop_worker", "route", worker=name):
+                status_obj = manager.stop_worker(name)
             return jsonify({
                 "type" : "end_status",
                 "message": f"{get_time()} SUCCESS : Request for {name} stop transmitted successfully.",
@@ -81,9 +83,34 @@ def worker_routes(manager):
         return jsonify({
             "type" : "status",
             "status": f'{get_time()} {status["status"]}',
-            "message_stack" : status["message_stack"]
+            "message_stack" : status["message_stack"],
+            "telemetry" : status["telemetry"],
+            "launch_profile" : status["launch_profile"],
+            "watchdog" : status["watchdog"]
             }), 200
+
+    @worker_routes.route("/telemetry_worker", methods=["POST"])
+    @cross_origin(headers=['Content-Type'], origins=['http://127.0.0.1:5000']) 
+    def telemetry_worker():
+        data = request.json
+        name = data.get("name")
+        try:
+            samples = manager.get_worker_telemetry(name, data.get("since", 0))
+            return jsonify({"type" : "telemetry", "samples" : samples}), 200
+        except Exception as e:
+            return jsonify({"type" : "error", "message" : f"{get_time()} {str(e)}"}), 200
     
+    # Chrome trace-event JSON : load it in chrome://tracing or ui.perfetto.dev
+    @worker_routes.route("/trace_session", methods=["GET"])
+    @worker_routes.route("/trace_session/<int:session_id>", methods=["GET"])
+    def trace_session(session_id = None):
+        try:
+            trace = manager.get_trace(session_id)
+            filename = f"orchestrator_trace_session_{trace['otherData']['session']}.json"
+            return jsonify(trace), 200, {"Content-Disposition" : f'attachment; filename="{filename}"'}
+        except Exception as e:
+            return jsonify({"type" : "error", "message" : f"{get_time()} {str(e)}"}), 404
+
     """
     @worker_routes.route("/status_worker", methods=["OPTIONS"])
     @cross_origin(headers=['Content-Type'], origins=['http://127.0.0.1:5000']) 
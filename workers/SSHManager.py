@@ -1,10 +1,13 @@
 import os, platform, sys
 from datetime import datetime
-import re
-import threading, paramiko
+import re, json, posixpath, shlex
+import threading, paramiko, socket, socketserver, select
+from queue import Queue, Empty
 from paramiko.ssh_exception import SSHException, NoValidConnectionsError
 from signal import Signals
 from config import main_config as config
+from workers.tracing import Tracer
+from workers.file_hashes import fingerprint
 from dotenv import load_dotenv
 load_dotenv()
 import time
@@ -16,8 +19,103 @@ def get_time():
 	current_datetime = datetime.now()
 	return current_datetime.strftime("%Y-%m-%d %H:%M:%S") + " :"
 
+# Sampled on the remote host by a single long-lived shell : one line per sample, fields separated by "|"
+# (anchored on the python command line, so that neither the shell wrapper of run_command, the sampler itself
+# nor the daemon.py of another user is counted)
+telemetry_script = """while true; do
+cpu=$(head -n1 /proc/stat | cut -d' ' -f3-)
+mem=$(awk '/^MemTotal:|^MemAvailable:/{printf "%s ", $2}' /proc/meminfo)
+load=$(cut -d' ' -f1 /proc/loadavg)
+rss=0; for pid in $(pgrep -u "$(id -u)" -f '^([^ ]*/)?python[0-9.]* -u daemon.py'); do r=$(awk '/^VmRSS:/{print $2}' /proc/$pid/status 2>/dev/null); rss=$((rss + ${r:-0})); done
+gpu=$(command -v nvidia-smi >/dev/null 2>&1 && nvidia-smi --query-gpu=utilization.gpu,memory.used --format=csv,noheader,nounits | head -n1 | tr -d ' ')
+echo "$cpu|$mem|$load|$rss|$gpu"
+sleep $interval
+done"""
+
+def parse_telemetry_line(line, previous_cpu):
+	cpu_fields, mem_fields, load, rss, gpu = line.split("|")
+	cpu = [int(value) for value in cpu_fields.split()]
+	mem_total, mem_available = [int(value) for value in mem_fields.split()]
+	sample = {
+		"time": time.time(),
+		"cpu_percent": None,
+		"load_1min": float(load),
+		"mem_used_mb": (mem_total - mem_available) // 1024,
+		"mem_total_mb": mem_total // 1024,
+		"daemon_rss_mb": int(rss) // 1024,
+		"gpu_percent": None,
+		"gpu_mem_mb": None
+	}
+	# /proc/stat counters are cumulative : the load is the share of non-idle jiffies since the previous sample
+	if previous_cpu:
+		total = sum(cpu) - sum(previous_cpu)
+		idle = (cpu[3] + cpu[4]) - (previous_cpu[3] + previous_cpu[4])
+		if total > 0:
+			sample["cpu_percent"] = round(100 * (total - idle) / total, 1)
+	if gpu:
+		gpu_percent, gpu_mem = gpu.split(",")
+		sample["gpu_percent"] = int(gpu_percent)
+		sample["gpu_mem_mb"] = int(gpu_mem)
+	return sample, cpu
+
+deploy_cache_path = "deploy_manifest_cache.json"
+
+def build_manifest(local_dir, excluded_dirs = ("__pycache__", ".git")):
+	# Only the files whose size or mtime changed are hashed again (the checkpoints are large).
+	# The stat cache stays in the orchestrator folder, one entry per absolute path of a deployed tree
+	tree_key = os.path.abspath(local_dir)
+	cache = {}
+	if os.path.exists(deploy_cache_path):
+		with open(deploy_cache_path, "r") as f:
+			cache = json.load(f)
+	previous = cache.get(tree_key, {})
+
+	fingerprints = {}
+	for root, dirs, files in os.walk(local_dir):
+		dirs[:] = [d for d in dirs if d not in excluded_dirs]
+		for file in files:
+			file_path = os.path.join(root, file)
+			path = os.path.relpath(file_path, local_dir).replace(os.sep, "/")
+			fingerprints[path] = fingerprint(file_path, previous.get(path))
+
+	cache[tree_key] = fingerprints
+	with open(deploy_cache_path, "w") as f:
+		json.dump(cache, f)
+	return {path: entry["sha256"] for path, entry in fingerprints.items()}
+
+class ForwardServer(socketserver.ThreadingTCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+class ForwardHandler(socketserver.BaseRequestHandler):
+	# Each local connection gets its own channel, multiplexed over the authenticated transport
+	def handle(self):
+		try:
+			channel = self.server.transport.open_channel("direct-tcpip", self.server.remote_address, self.request.getpeername())
+		except Exception as e:
+			self.server.queue.put(f"{get_time()} ERROR : Port forward to {self.server.remote_address} refused : {e}")
+			return
+		self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		try:
+			while True:
+				readable, _, _ = select.select([self.request, channel], [], [])
+				if self.request in readable:
+					data = self.request.recv(65536)
+					if not data:
+						break
+					channel.sendall(data)
+				if channel in readable:
+					data = channel.recv(65536)
+					if not data:
+						break
+					self.request.sendall(data)
+		except (OSError, SSHException):
+			pass
+		finally:
+			channel.close()
+
 class SSHManager:
-	def __init__(self, full_address, key_file = None, password = None, stop_event = None, port=22, timeout=10):
+	def __init__(self, full_address, key_file = None, password = None, stop_event = None, port=22, timeout=10, tracer = None):
 		username, server_addr = full_address.split("@")
 		
 		self.hostname = server_addr
@@ -28,6 +126,8 @@ class SSHManager:
 		self.timeout = timeout
 		self.client = None
 		self.stop_event = stop_event
+		self.forward_server = None
+		self.tracer = tracer or Tracer()
 
 		self.client = paramiko.SSHClient()
 		self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -61,7 +161,24 @@ class SSHManager:
 		self.client.get_transport().set_keepalive(10)
 		queue.put(f'{get_time()} INFO : Connected to SSH server')
 
+	def start_port_forward(self, local_port, remote_port, queue, remote_host = "127.0.0.1"):
+		if not self.client:
+			raise ConnectionError("SSH connection is not established.")
+		self.forward_server = ForwardServer(("127.0.0.1", local_port), ForwardHandler)
+		self.forward_server.transport = self.client.get_transport()
+		self.forward_server.remote_address = (remote_host, remote_port)
+		self.forward_server.queue = queue
+		threading.Thread(target = self.forward_server.serve_forever, daemon = True).start()
+		queue.put(f"{get_time()} INFO : Forwarding 127.0.0.1:{local_port} to {remote_host}:{remote_port} on the SSH server")
+
+	def stop_port_forward(self):
+		if self.forward_server:
+			self.forward_server.shutdown()
+			self.forward_server.server_close()
+			self.forward_server = None
+
 	def disconnect(self, queue):
+		self.stop_port_forward()
 		if self.client:
 			self.client.close()
 			self.client = None
@@ -146,6 +263,7 @@ class SSHManager:
 		try:
 			queue.put(f"{get_time()} INFO : Running a command on the remote server")
 			stdin, stdout, stderr = self.client.exec_command(command)
+			self.tracer.instant("remote command launched", "ssh", command = command)
 
 			threading.Thread(target = self.read_output, args = (stdout, stderr, queue), daemon = True).start()
 
@@ -155,12 +273,14 @@ class SSHManager:
 	def read_output(self, stdout, stderr, queue):
 		try:
 			for line in iter(stdout.readline, ""):
+				self.tracer.output_line("server", line.strip())
 				if queue:
 					queue.put(line.strip())  # Send to orchestrator
 
 			queue.put(f"{get_time()} : INFO : no more lines returned by SSH")
 			stdout.channel.close()
 			exit_status = stdout.channel.recv_exit_status()
+			self.tracer.instant("remote command exited", "ssh", exit_status = exit_status)
 			# output = stdout.read().decode().strip()
 			error = stderr.read().decode().strip()
 			if error:
@@ -173,6 +293,145 @@ class SSHManager:
 		except Exception as e:
 			queue.put(f'Thread reading the output of SSH was terminated with an exception : {e}')
 
+	def start_telemetry(self, telemetry_queue, queue, interval = 2):
+		if not self.client:
+			raise ConnectionError("SSH connection is not established.")
+		# One channel for the whole session, rather than an exec_command per sample
+		channel = self.client.get_transport().open_session()
+		channel.exec_command(f"interval={interval}; {telemetry_script}")
+		threading.Thread(target = self.read_telemetry, args = (channel, telemetry_queue, queue), daemon = True).start()
+		queue.put(f"{get_time()} INFO : Telemetry sampler started on the remote server")
+
+	def read_telemetry(self, channel, telemetry_queue, queue):
+		previous_cpu = None
+		try:
+			for line in channel.makefile("r"):
+				try:
+					sample, previous_cpu = parse_telemetry_line(line.strip(), previous_cpu)
+				except ValueError:
+					continue
+				telemetry_queue.put(sample)
+		except Exception as e:
+			queue.put(f'{get_time()} ERROR : Thread reading the telemetry of SSH was terminated with an exception : {e}')
+		finally:
+			channel.close()
+
+	def run_and_wait(self, command):
+		stdin, stdout, stderr = self.client.exec_command(command)
+		exit_status = stdout.channel.recv_exit_status()
+		output = stdout.read().decode().strip()
+		error = stderr.read().decode().strip()
+		stdout.channel.close()
+		if exit_status != 0:
+			raise RuntimeError(f"Remote command '{command}' failed with exit code {exit_status}: {error}")
+		return output
+
+	def deploy(self, local_dir, remote_dir, queue, channels = 4, kept_releases = 3):
+		"""
+		Sync local_dir to remote_dir (relative to the remote home), uploading only the files whose hash changed.
+		remote_dir becomes a symlink to remote_dir.releases/<release>, switched atomically once the upload is complete.
+		"""
+		if not self.client:
+			raise ConnectionError("SSH connection is not established.")
+
+		local_manifest = build_manifest(local_dir)
+		releases_dir = f"{remote_dir}.releases"
+		manifest_name = ".deploy_manifest.json"
+		# every path interpolated in a remote command goes through shlex.quote
+		q = shlex.quote
+		# symlink targets are relative to the folder holding remote_dir and its releases
+		releases_name = posixpath.basename(releases_dir)
+
+		# A first deployment over a plain folder : it becomes the initial release
+		self.run_and_wait(
+			f'mkdir -p {q(releases_dir)} && '
+			f'if [ -d {q(remote_dir)} ] && [ ! -L {q(remote_dir)} ]; then mv {q(remote_dir)} {q(releases_dir + "/initial")} && ln -s {q(releases_name + "/initial")} {q(remote_dir)}; fi'
+		)
+
+		sftp = self.client.open_sftp()
+		try:
+			current_release = None
+			remote_manifest = {}
+			try:
+				current_release = posixpath.basename(sftp.readlink(remote_dir).rstrip("/"))
+				with sftp.open(f"{releases_dir}/{current_release}/{manifest_name}", "r") as f:
+					remote_manifest = json.loads(f.read().decode())
+			except IOError:
+				pass
+
+			changed = [path for path, sha in local_manifest.items() if remote_manifest.get(path) != sha]
+			removed = [path for path in remote_manifest if path not in local_manifest]
+			if current_release and not changed and not removed:
+				queue.put(f"{get_time()} INFO : Remote {remote_dir} is up to date ({current_release})")
+				return current_release
+
+			# the suffix keeps two deploys within the same second apart
+			release = datetime.now().strftime("%Y%m%d%H%M%S") + f"-{os.urandom(3).hex()}"
+			release_dir = f"{releases_dir}/{release}"
+			# Hard-link the current release so that unchanged files cost nothing ; changed ones are renamed over the links
+			if current_release:
+				self.run_and_wait(f'cp -al {q(releases_dir + "/" + current_release)} {q(release_dir)}')
+			else:
+				self.run_and_wait(f'mkdir -p {q(release_dir)}')
+
+			dirs = sorted({posixpath.dirname(path) for path in changed} - {""})
+			if dirs:
+				self.run_and_wait("mkdir -p " + " ".join(q(f"{release_dir}/{d}") for d in dirs))
+			for path in removed:
+				sftp.remove(f"{release_dir}/{path}")
+
+			queue.put(f"{get_time()} INFO : Uploading {len(changed)} changed files to {release_dir} ({len(removed)} removed)")
+			self.upload_files(local_dir, release_dir, changed, channels)
+
+			with sftp.open(f"{release_dir}/{manifest_name}.part", "w") as f:
+				f.write(json.dumps(local_manifest))
+			sftp.posix_rename(f"{release_dir}/{manifest_name}.part", f"{release_dir}/{manifest_name}")
+
+			# rename() over the symlink is atomic : daemon.py is never started on a half-uploaded tree
+			self.run_and_wait(
+				f'ln -sfn {q(releases_name + "/" + release)} {q(remote_dir + ".next")} && mv -Tf {q(remote_dir + ".next")} {q(remote_dir)}'
+			)
+			self.run_and_wait(
+				# names follow the local clock, which may be behind : the live release and the previous one are never pruned
+				f'cd {q(releases_dir)} && ls -1 | grep -E "^[0-9]+(-[0-9a-f]+)?$" | grep -v -x -e {q(release)} -e {q(current_release or release)} '
+				f'| sort -r | tail -n +{max(kept_releases - 1, 1)} | xargs -r rm -rf'
+			)
+			queue.put(f"{get_time()} INFO : Deployed release {release} to {remote_dir}")
+			return release
+		finally:
+			sftp.close()
+
+	def upload_files(self, local_dir, release_dir, paths, channels):
+		files = Queue()
+		for path in paths:
+			files.put(path)
+		errors = []
+
+		def upload():
+			# Each thread gets its own SFTP channel, multiplexed over the same transport
+			sftp = paramiko.SFTPClient.from_transport(self.client.get_transport())
+			try:
+				while True:
+					try:
+						path = files.get_nowait()
+					except Empty:
+						return
+					remote_path = f"{release_dir}/{path}"
+					sftp.put(os.path.join(local_dir, *path.split("/")), remote_path + ".part")
+					sftp.posix_rename(remote_path + ".part", remote_path)
+			except Exception as e:
+				errors.append(e)
+			finally:
+				sftp.close()
+
+		threads = [threading.Thread(target = upload, daemon = True) for _ in range(min(channels, len(paths)))]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		if errors:
+			raise RuntimeError(f"Upload failed: {errors[0]}")
+
 	def is_server_reachable(self):
 		"""Check if the server is reachable."""
 		try:
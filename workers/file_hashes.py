@@ -0,0 +1,19 @@
+import os, hashlib
+
+hash_chunk_size = 1024 * 1024
+
+def hash_file(file_path):
+	sha = hashlib.sha256()
+	with open(file_path, "rb") as f:
+		for chunk in iter(lambda: f.read(hash_chunk_size), b""):
+			sha.update(chunk)
+	return sha.hexdigest()
+
+def fingerprint(file_path, previous):
+	# Size and mtime unchanged : trust the hash computed last time instead of reading the file again
+	stat = os.stat(file_path)
+	if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+		sha = previous["sha256"]
+	else:
+		sha = hash_file(file_path)
+	return {"sha256": sha, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
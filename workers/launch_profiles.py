@@ -0,0 +1,160 @@
+import os, sys, json, subprocess
+import psutil
+
+if sys.platform == "win32":
+	import ctypes
+	from ctypes import wintypes
+
+psutil_ionice_classes = {"realtime": "IOPRIO_CLASS_RT", "best_effort": "IOPRIO_CLASS_BE", "idle": "IOPRIO_CLASS_IDLE"}
+
+def windows_priority_class(nice):
+	if nice <= -10:
+		return psutil.HIGH_PRIORITY_CLASS
+	elif nice < 0:
+		return psutil.ABOVE_NORMAL_PRIORITY_CLASS
+	elif nice == 0:
+		return psutil.NORMAL_PRIORITY_CLASS
+	elif nice < 10:
+		return psutil.BELOW_NORMAL_PRIORITY_CLASS
+	return psutil.IDLE_PRIORITY_CLASS
+
+def windows_io_priority(ionice):
+	if ionice["class"] == "realtime":
+		return psutil.IOPRIO_HIGH
+	elif ionice["class"] == "idle":
+		return psutil.IOPRIO_VERYLOW
+	return psutil.IOPRIO_NORMAL
+
+def set_ionice(process, ionice):
+	if sys.platform == "win32":
+		process.ionice(windows_io_priority(ionice))
+	else:
+		level = None if ionice["class"] == "idle" else ionice.get("level", 4)
+		process.ionice(getattr(psutil, psutil_ionice_classes[ionice["class"]]), level)
+
+def posix_settings(process):
+	return {
+		"cpu_affinity": lambda value: process.cpu_affinity(value),
+		"nice": lambda value: process.nice(value),
+		"ionice": lambda value: set_ionice(process, value),
+		"memory_limit_mb": lambda value: process.rlimit(psutil.RLIMIT_AS, (value * 1024 * 1024, value * 1024 * 1024)),
+		"cpu_time_limit_s": lambda value: process.rlimit(psutil.RLIMIT_CPU, (value, value)),
+	}
+
+def windows_settings(process, job_limits):
+	return {
+		"cpu_affinity": lambda value: process.cpu_affinity(value),
+		"nice": lambda value: process.nice(windows_priority_class(value)),
+		"ionice": lambda value: set_ionice(process, value),
+		# collected here, set at once on the job object by apply_job_limits()
+		"memory_limit_mb": lambda value: job_limits.update(memory_limit_mb = value),
+		"cpu_time_limit_s": lambda value: job_limits.update(cpu_time_limit_s = value),
+	}
+
+def apply_settings(settings, profile):
+	report = {"applied": {}, "failed": {}}
+	for key, value in (profile or {}).items():
+		if value is None:
+			continue
+		if key not in settings:
+			report["failed"][key] = "unknown setting"
+			continue
+		try:
+			settings[key](value)
+			report["applied"][key] = value
+		except Exception as e:
+			report["failed"][key] = str(e) or type(e).__name__
+	return report
+
+if sys.platform == "win32":
+	JOB_OBJECT_LIMIT_PROCESS_TIME = 0x2
+	JOB_OBJECT_LIMIT_PROCESS_MEMORY = 0x100
+	JobObjectExtendedLimitInformation = 9
+
+	class JOBOBJECT_BASIC_LIMIT_INFORMATION(ctypes.Structure):
+		_fields_ = [
+			("PerProcessUserTimeLimit", ctypes.c_int64),
+			("PerJobUserTimeLimit", ctypes.c_int64),
+			("LimitFlags", wintypes.DWORD),
+			("MinimumWorkingSetSize", ctypes.c_size_t),
+			("MaximumWorkingSetSize", ctypes.c_size_t),
+			("ActiveProcessLimit", wintypes.DWORD),
+			("Affinity", ctypes.c_size_t),
+			("PriorityClass", wintypes.DWORD),
+			("SchedulingClass", wintypes.DWORD),
+		]
+
+	class IO_COUNTERS(ctypes.Structure):
+		_fields_ = [(name, ctypes.c_uint64) for name in (
+			"ReadOperationCount", "WriteOperationCount", "OtherOperationCount",
+			"ReadTransferCount", "WriteTransferCount", "OtherTransferCount"
+		)]
+
+	class JOBOBJECT_EXTENDED_LIMIT_INFORMATION(ctypes.Structure):
+		_fields_ = [
+			("BasicLimitInformation", JOBOBJECT_BASIC_LIMIT_INFORMATION),
+			("IoInfo", IO_COUNTERS),
+			("ProcessMemoryLimit", ctypes.c_size_t),
+			("JobMemoryLimit", ctypes.c_size_t),
+			("PeakProcessMemoryUsed", ctypes.c_size_t),
+			("PeakJobMemoryUsed", ctypes.c_size_t),
+		]
+
+def apply_job_limits(sp, job_limits):
+	# Windows has no rlimits : the process is put in a job object carrying the limits.
+	# The job lives as long as a process is assigned to it, so our handle can be closed right away
+	kernel32 = ctypes.WinDLL("kernel32", use_last_error = True)
+	kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+	info = JOBOBJECT_EXTENDED_LIMIT_INFORMATION()
+	if job_limits.get("memory_limit_mb"):
+		info.BasicLimitInformation.LimitFlags |= JOB_OBJECT_LIMIT_PROCESS_MEMORY
+		info.ProcessMemoryLimit = job_limits["memory_limit_mb"] * 1024 * 1024
+	if job_limits.get("cpu_time_limit_s"):
+		info.BasicLimitInformation.LimitFlags |= JOB_OBJECT_LIMIT_PROCESS_TIME
+		info.BasicLimitInformation.PerProcessUserTimeLimit = job_limits["cpu_time_limit_s"] * 10_000_000  # in 100 ns
+	job = kernel32.CreateJobObjectW(None, None)
+	if not job:
+		raise ctypes.WinError(ctypes.get_last_error())
+	try:
+		if not kernel32.SetInformationJobObject(wintypes.HANDLE(job), JobObjectExtendedLimitInformation, ctypes.byref(info), ctypes.sizeof(info)):
+			raise ctypes.WinError(ctypes.get_last_error())
+		if not kernel32.AssignProcessToJobObject(wintypes.HANDLE(job), wintypes.HANDLE(int(sp._handle))):
+			raise ctypes.WinError(ctypes.get_last_error())
+	finally:
+		kernel32.CloseHandle(wintypes.HANDLE(job))
+
+def launch_with_profile(command, profile, **popen_kwargs):
+	"""
+	Popen() with a launch profile (see launch_profiles in config.py).
+	Returns the subprocess and what was applied and, for each setting which could not be, the reason.
+	"""
+	if sys.platform == "win32":
+		sp = subprocess.Popen(command, **popen_kwargs)
+		job_limits = {}
+		report = apply_settings(windows_settings(psutil.Process(sp.pid), job_limits), profile)
+		if job_limits:
+			try:
+				apply_job_limits(sp, job_limits)
+			except Exception as e:
+				for key in job_limits:
+					del report["applied"][key]
+					report["failed"][key] = str(e)
+		return sp, report
+
+	# On Linux, affinity, priorities and rlimits only apply to the calling thread and to the threads it creates afterwards :
+	# they are set in the child before exec, and the report comes back through a pipe closed by the exec
+	read_fd, write_fd = os.pipe()
+
+	def apply_before_exec():
+		report = apply_settings(posix_settings(psutil.Process()), profile)
+		os.write(write_fd, json.dumps(report).encode())
+
+	try:
+		sp = subprocess.Popen(command, preexec_fn = apply_before_exec, **popen_kwargs)
+	except Exception:
+		os.close(read_fd)
+		raise
+	finally:
+		os.close(write_fd)
+	with os.fdopen(read_fd, "rb") as f:
+		return sp, json.loads(f.read() or b'{"applied": {}, "failed": {}}')
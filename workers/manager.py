@@ -1,4 +1,6 @@
-import sys, multiprocessing
+import os, re, sys, time, multiprocessing, threading
+from collections import deque
+from datetime import datetime
 from multiprocessing import get_context
 # if getattr(sys, 'frozen', False):
 
@@ -8,8 +10,18 @@ multiprocessing.set_start_method('spawn', force=True)
 
 from args_parser import args as cmd_line_args
 
-from workers.worker_states import WorkerState
+from workers.worker_states import WorkerState, ACTIVE_STATES
+from workers.watchdog import OutputWatchdog
 from workers.workers_definitions import workers
+from workers.tracing import Tracer, now_us
+from config import main_config
+
+def get_time():
+    current_datetime = datetime.now()
+    return current_datetime.strftime("%Y-%m-%d %H:%M:%S") + " :"
+
+# Lines produced by the orchestrator itself (get_time() prefix) : the watchdog only counts the output of the worker
+orchestrator_line = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} :")
 
 # curl -d "{\"name\" : \"server\"}" -H "Content-Type:application/json" -X POST http://localhost:3001/start_worker
 
@@ -17,63 +29,251 @@ class WorkerManager:
     def __init__(self):
         self.worker_ctors = workers
         self.workers = {}
+        # Held while a worker is started, stopped or restarted, by the routes and the watchdog alike
+        self.lifecycle_locks = {name: threading.RLock() for name in self.worker_ctors}
         self.message_queues = {}  # A dictionary to store message queues for each worker
+        self.pending_messages = {}  # Messages already drained from the queues (by the watchdog), not yet sent in a status
+        self.messages_lock = threading.Lock()
+        self.telemetry_queues = {}  # Samples of the remote host, only filled by workers which define a telemetry_queue
+        self.telemetry = {}
+
+        # Trace events of every process, split into sessions : a session begins when a worker starts while none is running
+        self.trace_queue = multiprocessing.Queue()
+        self.tracer = Tracer(self.trace_queue)
+        self.tracer.name_process("orchestrator")
+        self.trace_sessions = []
+        self.trace_events = []
+        self.trace_metadata = []
 
         for name in self.worker_ctors:
             self.message_queues[name] = multiprocessing.Queue()  # Each worker gets a unique queue
+            self.pending_messages[name] = []
+            self.telemetry_queues[name] = multiprocessing.Queue()
+            self.telemetry[name] = deque(maxlen = main_config.telemetry_history)
             self.reset_worker_instance(name)
 
+        self.watchdog = OutputWatchdog(main_config.watchdog_thresholds)
+        self.watchdog_reports = {}
+        self.watchdog_restarts = {}  # automatic restarts since the last start requested by the user
+        threading.Thread(target = self.run_watchdog, daemon = True).start()
+
     def reset_worker_instance(self, name):
         self.workers[name] = self.worker_ctors[name](debug = cmd_line_args.debug, dist = cmd_line_args.dist, avatar_type = cmd_line_args.avatar_type)
         self.workers[name].print_queue = self.message_queues[name]
+        if hasattr(self.workers[name], "telemetry_queue"):
+            self.workers[name].telemetry_queue = self.telemetry_queues[name]
+        self.workers[name].tracer = Tracer(self.trace_queue)
         self.workers[name].state = WorkerState.STOPPED
 
-    def start_worker(self, name, *args):
-        if name in self.workers and self.workers[name].state == WorkerState.RUNNING:
-            raise RuntimeError(f"ERROR : {name} : Worker is already running.")
-        elif name not in self.workers:
+    def start_worker(self, name, *args, by_watchdog = False):
+        if name not in self.workers:
             raise RuntimeError(f"No instance available for Worker {name}.")
-        if cmd_line_args.ssh_addr:
-            try:
-                # for ssh connecting processes, don't forget to adapt the remote env init command to the actual ssh env of your provider (in config.py)
-                self.workers[name].start()
-                self.workers[name].state = WorkerState.RUNNING
-            except Exception as e:
-                raise e
+        with self.lifecycle_locks[name]:
+            if self.workers[name].state in ACTIVE_STATES:
+                raise RuntimeError(f"ERROR : {name} : Worker is already running.")
+            if cmd_line_args.ssh_addr:
+                try:
+                    # for ssh connecting processes, don't forget to adapt the remote env init command to the actual ssh env of your provider (in config.py)
+                    self.telemetry[name].clear()
+                    if not any(worker.state in ACTIVE_STATES for worker in self.workers.values()):
+                        self.start_trace_session()
+                    with self.tracer.span(f"{name} spawn", "spawn"):
+                        self.workers[name].start()
+                    self.workers[name].state = WorkerState.RUNNING
+                    self.watchdog.reset(name, time.time())
+                    if not by_watchdog:
+                        self.watchdog_restarts.pop(name, None)
+                except Exception as e:
+                    raise e
 
-        return self.format_status(name, f"{self.workers[name].state.value}")
+            return self.format_status(name, self.state_text(self.workers[name].state))
 
     def stop_worker(self, name):
-        worker = self.workers[name]
-        if worker and worker.state == WorkerState.RUNNING:
-            worker.terminate()
-            worker.state = WorkerState.STOPPED
-            status_obj = self.format_status(name, f"{name} {worker.state.value}")
-            self.reset_worker_instance(name)
-            return status_obj
-        else:
-            self.reset_worker_instance(name)
-            raise Exception(f"ERROR : {name} : Worker already stopped or not started")
+        with self.lifecycle_locks[name]:
+            worker = self.workers[name]
+            if worker and worker.state in ACTIVE_STATES:
+                with self.tracer.span(f"{name} stop", "stop"):
+                    worker.terminate()
+                worker.state = WorkerState.STOPPED
+                status_obj = self.format_status(name, f"{name} {worker.state.value}")
+                self.reset_worker_instance(name)
+                return status_obj
+            else:
+                self.reset_worker_instance(name)
+                raise Exception(f"ERROR : {name} : Worker already stopped or not started")
 
     def get_worker_status(self, name):
         worker = self.workers.get(name)
         if not worker:
             return self.format_status(name, f"ERROR : {name} : No instance available for Worker")
 
-        if worker.state == WorkerState.RUNNING and not worker.is_alive():
+        if worker.state in ACTIVE_STATES and not worker.is_alive():
             worker.state = WorkerState.ERROR
-        return self.format_status(name, f"{worker.state.value}")
+        return self.format_status(name, self.state_text(worker.state))
 
-    def format_status(self, name, status_string):
-        # Get the messages in the queue (non-blocking)
-        messages = []
-        queue = self.message_queues[name]
+    def state_text(self, state):
+        # The frontend only knows running / stopped / ERROR : a degraded or stalled worker still runs, the details are in "watchdog"
+        if state in (WorkerState.DEGRADED, WorkerState.STALLED):
+            return f"{WorkerState.RUNNING.value} ({state.value})"
+        return f"{state.value}"
+
+    def get_worker_telemetry(self, name, since = 0):
+        if name not in self.telemetry:
+            raise RuntimeError(f"No instance available for Worker {name}.")
+        self.collect_telemetry(name)
+        return [sample for sample in self.telemetry[name] if sample["time"] > since]
+
+    def collect_telemetry(self, name):
+        queue = self.telemetry_queues[name]
         try:
             while not queue.empty():
-                messages.append(queue.get_nowait())
+                self.telemetry[name].append(queue.get_nowait())
+        except:
+            pass
+
+    def start_trace_session(self):
+        self.collect_trace()
+        session_id = self.trace_sessions[-1]["id"] + 1 if self.trace_sessions else 1
+        self.trace_sessions.append({"id": session_id, "start": now_us()})
+        if len(self.trace_sessions) > main_config.trace_sessions_kept:
+            self.trace_sessions.pop(0)
+            self.trace_events = [event for event in self.trace_events if self.trace_event_time(event) >= self.trace_sessions[0]["start"]]
+            # every worker run is a new pid : forget the names of those which left no event behind (the orchestrator's stays)
+            pids = {event["pid"] for event in self.trace_events} | {os.getpid()}
+            self.trace_metadata = [event for event in self.trace_metadata if event["pid"] in pids]
+
+    def trace_event_time(self, event):
+        # Spans are filed by their end : the route span that opened a session belongs to it
+        return event["ts"] + event.get("dur", 0)
+
+    def collect_trace(self):
+        try:
+            while not self.trace_queue.empty():
+                event = self.trace_queue.get_nowait()
+                if event["ph"] == "M":
+                    self.trace_metadata.append(event)
+                elif self.trace_sessions and self.trace_event_time(event) >= self.trace_sessions[0]["start"]:
+                    self.trace_events.append(event)
         except:
             pass
+
+    def get_trace(self, session_id = None):
+        self.collect_trace()
+        if not self.trace_sessions:
+            raise RuntimeError("No session has been traced yet.")
+        ids = [session["id"] for session in self.trace_sessions]
+        if session_id is None:
+            session_id = ids[-1]
+        if session_id not in ids:
+            raise RuntimeError(f"No trace available for session {session_id}, available sessions : {ids}.")
+        index = ids.index(session_id)
+        start = self.trace_sessions[index]["start"]
+        end = self.trace_sessions[index + 1]["start"] if index + 1 < len(ids) else float("inf")
+        events = [event for event in self.trace_events if start <= self.trace_event_time(event) < end]
+        pids = {event["pid"] for event in events}
+        return {
+            "traceEvents": [event for event in self.trace_metadata if event["pid"] in pids] + sorted(events, key = lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": {"session": session_id, "sessions": ids}
+        }
+
+    def collect_launch_profile(self, name):
+        worker = self.workers[name]
+        if not hasattr(worker, "launch_profile"):
+            return None
+        try:
+            while worker.origin_con.poll():
+                kind, report = worker.origin_con.recv()
+                if kind == "launch_profile":
+                    worker.launch_profile = report
+        except (EOFError, OSError):
+            pass
+        return worker.launch_profile
+
+    def run_watchdog(self):
+        while True:
+            time.sleep(main_config.watchdog_interval)
+            for name, worker in list(self.workers.items()):
+                if worker.state not in ACTIVE_STATES or name not in self.watchdog.activity:
+                    continue
+                # a start or stop in progress from a route : check again on the next round
+                if not self.lifecycle_locks[name].acquire(blocking = False):
+                    continue
+                try:
+                    # the worker may have been stopped or replaced between the listing and the lock
+                    if self.workers[name] is worker and worker.state in ACTIVE_STATES:
+                        self.check_worker_output(name, worker)
+                except Exception as e:
+                    self.add_message(name, f"{get_time()} ERROR : Watchdog : failed to check {name} : {e}")
+                finally:
+                    self.lifecycle_locks[name].release()
+
+    def check_worker_output(self, name, worker):
+        # called with the lifecycle lock of the worker held
+        self.drain_messages(name)
+        now = time.time()
+        state, report = self.watchdog.evaluate(name, now)
+        self.watchdog_reports[name] = report
+        if state != worker.state:
+            worker.state = state
+            self.tracer.instant(f"{name} {state.value}", "watchdog", **report)
+            level = "INFO" if state == WorkerState.RUNNING else "WARNING"
+            self.add_message(name, f"{get_time()} {level} : Watchdog : {name} is {state.value} ({report['lines_per_min']} lines/min, baseline {report['baseline_lines_per_min']}, silent for {report['silent_for_s']}s)")
+
+        thresholds = main_config.watchdog_thresholds.get(name, {})
+        if state.value in thresholds.get("restart_on", []):
+            self.restart_worker(name, thresholds, now)
+
+    def restart_worker(self, name, thresholds, now):
+        # At most max_restarts automatic restarts per start from the user, each one waiting twice as long as the previous
+        restarts = self.watchdog_restarts.setdefault(name, {"count": 0, "last": 0, "gave_up": False})
+        if restarts["count"] >= thresholds.get("max_restarts", 3):
+            if not restarts["gave_up"]:
+                restarts["gave_up"] = True
+                self.add_message(name, f"{get_time()} ERROR : Watchdog : {name} still {self.workers[name].state.value} after {restarts['count']} restarts, giving up")
+            return
+        backoff = thresholds.get("restart_backoff_s", 30) * 2 ** (restarts["count"] - 1) if restarts["count"] else 0
+        if now - restarts["last"] < backoff:
+            return
+        restarts["count"] += 1
+        restarts["last"] = now
+
+        self.add_message(name, f"{get_time()} WARNING : Watchdog : restarting {name} ({restarts['count']}/{thresholds.get('max_restarts', 3)})")
+        stop_status = self.stop_worker(name)
+        self.add_message(name, *stop_status["message_stack"])
+        start_status = self.start_worker(name, by_watchdog = True)
+        self.add_message(name, *start_status["message_stack"])
+
+    def drain_messages(self, name):
+        # Get the messages in the queue (non-blocking), counted as output activity by the watchdog
+        queue = self.message_queues[name]
+        count = 0
+        with self.messages_lock:
+            try:
+                while not queue.empty():
+                    message = queue.get_nowait()
+                    self.pending_messages[name].append(message)
+                    if not orchestrator_line.match(str(message)):
+                        count += 1
+            except:
+                pass
+        self.watchdog.record(name, count, time.time())
+
+    def add_message(self, name, *messages):
+        with self.messages_lock:
+            self.pending_messages[name].extend(messages)
+
+    def format_status(self, name, status_string):
+        self.drain_messages(name)
+        with self.messages_lock:
+            messages = self.pending_messages[name]
+            self.pending_messages[name] = []
+        self.collect_telemetry(name)
+        self.collect_trace()
         return {
             "status": f"{status_string}",
-            "message_stack": messages
+            "message_stack": messages,
+            "telemetry": self.telemetry[name][-1] if self.telemetry[name] else None,
+            "launch_profile": self.collect_launch_profile(name),
+            "watchdog": self.watchdog_reports.get(name) if self.workers[name].state in ACTIVE_STATES else None
         }
@@ -0,0 +1,48 @@
+import os, re, time, threading
+from contextlib import contextmanager
+from config import main_config
+
+# Events follow the Chrome trace-event format (chrome://tracing, Perfetto) : timestamps in microseconds
+def now_us():
+	return time.time_ns() // 1000
+
+class Tracer:
+	"""
+	Sends trace events to the queue drained by the WorkerManager.
+	Workers get their own instance, so it has to stay picklable : without a queue, every call is a no-op.
+	"""
+	def __init__(self, queue = None):
+		self.queue = queue
+		self.output_seen = set()
+
+	def emit(self, event):
+		if not self.queue:
+			return
+		event["pid"] = os.getpid()
+		event["tid"] = threading.get_ident()
+		self.queue.put(event)
+
+	def name_process(self, name):
+		self.emit({"name": "process_name", "ph": "M", "ts": 0, "args": {"name": name}})
+
+	@contextmanager
+	def span(self, name, cat = "orchestrator", **args):
+		start = now_us()
+		try:
+			yield
+		finally:
+			self.emit({"name": name, "cat": cat, "ph": "X", "ts": start, "dur": now_us() - start, "args": args})
+
+	def instant(self, name, cat = "orchestrator", **args):
+		self.emit({"name": name, "cat": cat, "ph": "i", "s": "p", "ts": now_us(), "args": args})
+
+	def output_line(self, source, line):
+		if not self.queue:
+			return
+		if source not in self.output_seen:
+			self.output_seen.add(source)
+			self.instant(f"{source} first output line", "output", line = line[:200])
+		for marker in main_config.trace_readiness_markers:
+			if re.search(marker, line, re.IGNORECASE):
+				self.instant(f"{source} ready", "output", marker = marker, line = line[:200])
+				break
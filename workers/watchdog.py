@@ -0,0 +1,61 @@
+from collections import deque
+from workers.worker_states import WorkerState
+
+class OutputWatchdog:
+	"""
+	Tracks the output of each running worker : STALLED when it has been silent for longer than stall_after_s
+	(counted from its first output line, so a worker still starting up isn't stalled),
+	DEGRADED when it still produces lines but at a rate under degraded_ratio of its learned baseline
+	(or under min_lines_per_min). Thresholds are per worker, see watchdog_thresholds in config.py.
+	"""
+	def __init__(self, thresholds, baseline_smoothing = 0.2):
+		self.thresholds = thresholds
+		self.baseline_smoothing = baseline_smoothing
+		self.activity = {}
+		# lines per minute, learned over the healthy windows : kept across restarts of a worker
+		self.baselines = {}
+
+	def reset(self, name, now):
+		self.activity[name] = {"started": now, "last_activity": now, "last_baseline_update": now, "lines": deque(), "first_output": None}
+
+	def record(self, name, count, now):
+		activity = self.activity.get(name)
+		if not activity or not count:
+			return
+		activity["last_activity"] = now
+		if activity["first_output"] is None:
+			activity["first_output"] = now
+		activity["lines"].append((now, count))
+
+	def evaluate(self, name, now):
+		activity = self.activity[name]
+		thresholds = self.thresholds.get(name, {})
+		window = thresholds.get("rate_window_s", 60)
+
+		while activity["lines"] and activity["lines"][0][0] <= now - window:
+			activity["lines"].popleft()
+		rate = sum(count for _, count in activity["lines"]) * 60 / window
+		silent_for = now - activity["last_activity"]
+		baseline = self.baselines.get(name)
+		report = {
+			"lines_per_min": round(rate, 1),
+			"baseline_lines_per_min": round(baseline, 1) if baseline is not None else None,
+			"silent_for_s": round(silent_for, 1)
+		}
+
+		stall_after = thresholds.get("stall_after_s")
+		if stall_after and activity["first_output"] is not None and silent_for > stall_after:
+			return WorkerState.STALLED, report
+		# The first window after a start is the warm-up : the rate isn't meaningful yet
+		if now - activity["started"] < window or rate == 0:
+			return WorkerState.RUNNING, report
+
+		ratio = thresholds.get("degraded_ratio")
+		min_rate = thresholds.get("min_lines_per_min")
+		if (ratio and baseline and rate < baseline * ratio) or (min_rate and rate < min_rate):
+			return WorkerState.DEGRADED, report
+
+		if now - activity["last_baseline_update"] >= window:
+			activity["last_baseline_update"] = now
+			self.baselines[name] = rate if baseline is None else (1 - self.baseline_smoothing) * baseline + self.baseline_smoothing * rate
+		return WorkerState.RUNNING, report
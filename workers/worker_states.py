@@ -3,4 +3,9 @@ from enum import Enum
 class WorkerState(Enum):
     STOPPED = "stopped"
     RUNNING = "running"
+    DEGRADED = "degraded"
+    STALLED = "stalled"
     ERROR = "error"
+
+# States in which the worker process is (supposed to be) alive
+ACTIVE_STATES = (WorkerState.RUNNING, WorkerState.DEGRADED, WorkerState.STALLED)
@@ -4,6 +4,8 @@ import multiprocessing, threading, queue
 from multiprocessing import Process
 import subprocess
 from workers.SSHManager import SSHManager
+from workers.tracing import Tracer
+from workers.launch_profiles import launch_with_profile
 from dotenv import load_dotenv
 load_dotenv()
 from args_parser import args
@@ -28,29 +30,44 @@ class ServerWorker(Process):
 		self.dist = dist
 		self.state = None
 		self.print_queue = None
+		self.telemetry_queue = None
+		self.tracer = Tracer()
 		self.dest_con, self.origin_con = multiprocessing.Pipe()
 		
 	def run(self):
+		self.tracer.name_process(f"{self.name} worker")
 		try:
-			self.ssh_manager = SSHManager(args.ssh_addr, key_file=key_file)
-			self.ssh_manager.connect_to_server(self.print_queue)
+			self.ssh_manager = SSHManager(args.ssh_addr, key_file=key_file, tracer=self.tracer)
+			with self.tracer.span("ssh connect", "ssh", host=self.ssh_manager.hostname):
+				self.ssh_manager.connect_to_server(self.print_queue)
+			if self.telemetry_queue:
+				self.ssh_manager.start_telemetry(self.telemetry_queue, self.print_queue, main_config.telemetry_interval)
+			if args.ssh_forward:
+				self.ssh_manager.start_port_forward(main_config.forward_local_port, main_config.daemon_port, self.print_queue)
 			try:
+				if args.deploy_from and (self.debug or self.dist):
+					self.print_queue.put(f"{get_time()} WARNING : --deploy_from is ignored with --debug / --dist : the local Wav2Lip_with_cache is run as is, nothing was synced")
 				if self.debug:
 					server_command = f"cd {os.path.abspath('../Wav2Lip_with_cache')} && python -u daemon.py"
 				elif self.dist:
 					server_command = f"cd {os.path.abspath('../../../Wav2Lip_with_cache')} && python -u daemon.py"
 				else:
+					if args.deploy_from:
+						with self.tracer.span("deploy", "ssh"):
+							self.ssh_manager.deploy(args.deploy_from, main_config.remote_server_dir, self.print_queue)
 					# don't forget to adapt the remote env init command to the actual ssh env of your provider (in config.py)
-					server_command = f'{self.remote_env_init_command} cd Wav2Lip_with_cache && python -u daemon.py'
+					server_command = f'{self.remote_env_init_command} cd {main_config.remote_server_dir} && python -u daemon.py'
 
 				self.ssh_manager.run_command(server_command, self.print_queue, self.dest_con)
 
 				while not self.dest_con.poll(timeout = 0.1):
 					continue
 				
-				self.ssh_manager.send_sigint(self.print_queue)
+				with self.tracer.span("send SIGINT", "stop"):
+					self.ssh_manager.send_sigint(self.print_queue)
 				# self.print_queue.put(f"{get_time()} INFO : Confirmed function returnd after sending SIGINT")
-				self.ssh_manager.disconnect(self.print_queue)
+				with self.tracer.span("ssh disconnect", "stop"):
+					self.ssh_manager.disconnect(self.print_queue)
 			except RuntimeError as e:
 				self.print_queue.put(f"Failed to run the command start the server: {e}")
 				raise Exception(f"Failed to run the command start the server: {e}")
@@ -59,9 +76,10 @@ class ServerWorker(Process):
 			raise Exception(f"Raised exception when SSH-ing in ServerWorker {str(e)}")
 		
 	def terminate(self):
-		self.origin_con.send('stop')
-		time.sleep(8)
-		super().terminate()
+		with self.tracer.span(f"{self.name} terminate", "stop"):
+			self.origin_con.send('stop')
+			time.sleep(8)
+			super().terminate()
 
 class PlaybackWorker(Process):
 	name = "playback"
@@ -81,8 +99,11 @@ class PlaybackWorker(Process):
 		self.state = None
 		self.print_queue = None
 		self.output_queue = None
+		self.tracer = Tracer()
+		self.launch_profile = None
 
 	def run(self):
+		self.tracer.name_process(f"{self.name} worker")
 		self.output_queue = multiprocessing.Queue()
 		try:
 			# command = 'python -u video_playback_vlc.py'
@@ -93,12 +114,15 @@ class PlaybackWorker(Process):
 			else:
 				executable_path = os.path.abspath(f"Avatar_video_playback.exe --avatar_type {self.avatar_type}")
 
-			sp = subprocess.Popen(
-				# command,
-				executable_path,
-				# "../Wav2Lip_resident/",
-				stdout=subprocess.PIPE
-			)
+			with self.tracer.span("subprocess launch", "spawn"):
+				sp, launch_report = launch_with_profile(
+					# command,
+					executable_path,
+					main_config.launch_profiles.get(self.name),
+					# "../Wav2Lip_resident/",
+					stdout=subprocess.PIPE
+				)
+			self.report_launch_profile(launch_report)
 
 			# Start a thread to read the output (problem with sys.stdout, shared accross threads in the subprocess, colliding with reading it from another process)
 			threading.Thread(target=self.read_subprocess_output, args=(sp, self.output_queue), daemon=True).start()
@@ -114,11 +138,14 @@ class PlaybackWorker(Process):
 			
 			with open(self.exit_flag_path, "w") as f:
 				f.write("EXIT")
+			self.tracer.instant("exit flag written", "stop")
 
 			self.print_queue.put(f"{get_time()} INFO : about to kill the playback worker")
 
-			sp.terminate()
-			sp.wait(timeout=5)
+			with self.tracer.span("subprocess terminate", "stop"):
+				sp.terminate()
+				sp.wait(timeout=5)
+			self.tracer.instant("subprocess exited", "stop", returncode = sp.returncode)
 
 			if self.print_queue:
 				self.print_queue.put(f"{get_time()} INFO : Playback subprocess terminated.")
@@ -133,17 +160,26 @@ class PlaybackWorker(Process):
 					self.print_queue.put(f"{get_time()} INFO : Exit flag reset.")
 		
 	def terminate(self):
-		self.origin_con.send(True)
+		with self.tracer.span(f"{self.name} terminate", "stop"):
+			self.origin_con.send(True)
 
-		self.join(timeout=5)
+			self.join(timeout=5)
 
-		if self.is_alive():
-			super().terminate()
-			if self.print_queue:
-				self.print_queue.put(f"{get_time()} INFO : Playback forcefully terminated.")
+			if self.is_alive():
+				super().terminate()
+				if self.print_queue:
+					self.print_queue.put(f"{get_time()} INFO : Playback forcefully terminated.")
+
+	def report_launch_profile(self, report):
+		# the pipe is duplex : the manager reads the report on origin_con
+		self.dest_con.send(("launch_profile", report))
+		self.print_queue.put(f"{get_time()} INFO : Launch profile applied to the {self.name} subprocess : {report['applied']}")
+		if report["failed"]:
+			self.print_queue.put(f"{get_time()} WARNING : Launch profile settings not applied to the {self.name} subprocess : {report['failed']}")
 
 	def read_subprocess_output(self, sp, queue):
 		for line in iter(sp.stdout.readline, b''):
+			self.tracer.output_line(self.name, line.decode('utf-8').strip())
 			queue.put(line.decode('utf-8'))
 
 
@@ -159,8 +195,11 @@ class ClientWorker(Process):
 		self.state = None
 		self.print_queue = None
 		self.output_queue = None
+		self.tracer = Tracer()
+		self.launch_profile = None
 		
 	def run(self, ):
+		self.tracer.name_process(f"{self.name} worker")
 		self.output_queue = multiprocessing.Queue()
 		try:
 			# command = 'python -u worker.py'
@@ -170,11 +209,22 @@ class ClientWorker(Process):
 				executable_path = os.path.abspath(f"../runner/Avatar_runner.exe --avatar_type {self.avatar_type}")
 			else:
 				executable_path = os.path.abspath(f"Avatar_runner.exe --avatar_type {self.avatar_type}")
-			sp = subprocess.Popen(
-				executable_path,
-				# cwd = "../Wav2Lip_resident/",
-				stdout=subprocess.PIPE
-			)
+
+			env = None
+			if args.ssh_forward:
+				# load_dotenv() in the runner doesn't override an existing variable
+				env = {**os.environ, "SERVER_ADDR": f"http://127.0.0.1:{main_config.forward_local_port}"}
+				self.print_queue.put(f"{get_time()} INFO : Client will reach the server through the SSH port forward ({env['SERVER_ADDR']})")
+
+			with self.tracer.span("subprocess launch", "spawn"):
+				sp, launch_report = launch_with_profile(
+					executable_path,
+					main_config.launch_profiles.get(self.name),
+					# cwd = "../Wav2Lip_resident/",
+					stdout=subprocess.PIPE,
+					env=env
+				)
+			self.report_launch_profile(launch_report)
 
 			# Start a thread to read the output (problem with sys.stdout, shared accross threads in the subprocess, colliding with reading it from another process)
 			threading.Thread(target=self.read_subprocess_output, args=(sp, self.output_queue), daemon=True).start()
@@ -190,8 +240,10 @@ class ClientWorker(Process):
 
 			self.print_queue.put(f"{get_time()} INFO : about to kill the client worker")
 
-			sp.terminate()
-			sp.wait(timeout=5)
+			with self.tracer.span("subprocess terminate", "stop"):
+				sp.terminate()
+				sp.wait(timeout=5)
+			self.tracer.instant("subprocess exited", "stop", returncode = sp.returncode)
 
 			if self.print_queue:
 				self.print_queue.put(f"{get_time()} INFO : Client subprocess terminated.")
@@ -202,17 +254,26 @@ class ClientWorker(Process):
 			self.print_queue.put(f'Raised exception in ClientkWorker {str(e)}')
 		
 	def terminate(self):
-		self.origin_con.send(True)
+		with self.tracer.span(f"{self.name} terminate", "stop"):
+			self.origin_con.send(True)
 
-		self.join(timeout=5)
+			self.join(timeout=5)
 
-		if self.is_alive():
-			super().terminate()
-			if self.print_queue:
-				self.print_queue.put(f"{get_time()} INFO : Client forcefully terminated.")
+			if self.is_alive():
+				super().terminate()
+				if self.print_queue:
+					self.print_queue.put(f"{get_time()} INFO : Client forcefully terminated.")
+
+	def report_launch_profile(self, report):
+		# the pipe is duplex : the manager reads the report on origin_con
+		self.dest_con.send(("launch_profile", report))
+		self.print_queue.put(f"{get_time()} INFO : Launch profile applied to the {self.name} subprocess : {report['applied']}")
+		if report["failed"]:
+			self.print_queue.put(f"{get_time()} WARNING : Launch profile settings not applied to the {self.name} subprocess : {report['failed']}")
 
 	def read_subprocess_output(self, sp, queue):
 		for line in iter(sp.stdout.readline, b''):
+			self.tracer.output_line(self.name, line.decode('utf-8').strip())
 			queue.put(line.decode('utf-8'))
 
 workers = {